@@ -44,6 +44,7 @@ from fastapi_user_auth.admin.actions import (
     UpdateSubRolesAction,
 )
 from fastapi_user_auth.admin.utils import (
+    clear_subject_options_cache,
     get_admin_action_options,
     update_casbin_site_grouping,
 )
@@ -394,6 +395,7 @@ class CasbinRuleAdmin(ReadOnlyModelAdmin):
         await self.site.auth.enforcer.load_policy()
         # 更新站点资源分组
         await update_casbin_site_grouping(self.site.auth.enforcer, self.site)
+        clear_subject_options_cache()  # 清除主体页面权限缓存
 
     def register_router(self):
         @self.router.get("/load_policy", response_model=BaseApiOut)
@@ -1,6 +1,5 @@
-from copy import copy
 from functools import lru_cache
-from typing import Any, Callable, Dict, List, Tuple
+from typing import Any, Callable, Dict, Iterator, List, Tuple
 
 from casbin import AsyncEnforcer
 from fastapi_amis_admin.admin import FormAdmin, ModelAdmin, PageSchemaAdmin
@@ -8,7 +7,13 @@ from fastapi_amis_admin.admin.admin import AdminGroup, BaseActionAdmin, BaseAdmi
 from fastapi_amis_admin.utils.translation import i18n as _
 
 from fastapi_user_auth.auth.schemas import SystemUserEnum
-from fastapi_user_auth.utils.casbin import permission_encode, permission_enforce
+from fastapi_user_auth.utils.casbin import (
+    SUBJECT_OPTIONS_CACHE_SIZE,
+    clear_subject_options_cache,
+    permission_decode,
+    permission_encode,
+    subject_options_cache,
+)
 
 
 @lru_cache()
@@ -56,18 +61,38 @@ def get_admin_action_options(
 
 
 def filter_options(options: List[Dict[str, Any]], filter_func: Callable[[Dict[str, Any]], bool]) -> List[Dict[str, Any]]:
-    """过滤选项,包含子选项.如果选项的children为空,则删除该选项"""
-    result = []
+    """过滤选项,包含子选项.如果选项的children为空,则删除该选项.没有被过滤的选项直接复用,不会被复制"""
+    filtered: Dict[int, List[Dict[str, Any]]] = {}  # id(选项列表): 过滤后的选项列表
+    stack = [(options, False)]
+    while stack:  # 后序遍历,先过滤子选项
+        items, visited = stack.pop()
+        if not visited:
+            stack.append((items, True))
+            stack.extend((item["children"], False) for item in items if item.get("children"))
+            continue
+        result = []
+        for item in items:
+            children = item.get("children")
+            if children:
+                filtered_children = filtered[id(children)]
+                if not filter_func(item) and not filtered_children:  # 没有父级权限,并且没有子级权限
+                    continue
+                if filtered_children is not children:  # 子选项有变化,防止原children被修改
+                    item = {**item, "children": filtered_children}
+            elif not filter_func(item):
+                continue
+            result.append(item)
+        unchanged = len(result) == len(items) and all(a is b for a, b in zip(result, items))
+        filtered[id(items)] = items if unchanged else result
+    return filtered[id(options)]
+
+
+def _collect_values(options: List[Dict[str, Any]]) -> Iterator[str]:
+    """先序遍历选项树,获取全部选项的value"""
     for option in options:
-        option = copy(option)  # 防止children被修改
-        has_children = False
+        yield option["value"]
         if option.get("children"):
-            option["children"] = filter_options(option["children"], filter_func)
-            has_children = bool(option["children"])
-        if not filter_func(option) and not has_children:  # 没有父级权限,并且没有子级权限
-            continue
-        result.append(option)
-    return result
+            yield from _collect_values(option["children"])
 
 
 def get_admin_action_options_by_subject(
@@ -80,21 +105,37 @@ def get_admin_action_options_by_subject(
     options = get_admin_action_options(group)
     # 获取当前登录用户的权限
     if subject != "u:" + SystemUserEnum.ROOT:  # Root用户拥有全部权限
-        # 过滤掉没有权限的页面
-        options = filter_options(options, filter_func=lambda item: permission_enforce(enforcer, subject, item["value"]))
+        # 策略变更后需要调用clear_subject_options_cache清除缓存;全部页面权限重新生成后缓存自动失效
+        key = (id(enforcer), id(group), subject)
+        cached = subject_options_cache.get(key)
+        if cached and cached[0] is options:
+            subject_options_cache.move_to_end(key)
+            return cached[1]
+        # 批量执行casbin规则,然后过滤掉没有权限的页面
+        values = list(_collect_values(options))
+        results = enforcer.batch_enforce([[subject, *permission_decode(value)] for value in values])
+        allowed = dict(zip(values, results))
+        filtered = filter_options(options, filter_func=lambda item: allowed[item["value"]])
+        subject_options_cache[key] = (options, filtered)
+        subject_options_cache.move_to_end(key)
+        if len(subject_options_cache) > SUBJECT_OPTIONS_CACHE_SIZE:
+            subject_options_cache.popitem(last=False)
+        return filtered
     return options
 
 
-# 获取全部admin上下级关系
-def get_admin_grouping(group: AdminGroup) -> List[Tuple[str, str]]:
-    children = []
+def _iter_admin_grouping(group: AdminGroup) -> Iterator[Tuple[str, str]]:
     for admin in group:
         if admin is admin.app:
             continue
-        children.append((admin.app.unique_id, admin.unique_id))
+        yield admin.app.unique_id, admin.unique_id
         if isinstance(admin, AdminGroup):
-            children.extend(get_admin_grouping(admin))
-    return children
+            yield from _iter_admin_grouping(admin)
+
+
+# 获取全部admin上下级关系
+def get_admin_grouping(group: AdminGroup) -> List[Tuple[str, str]]:
+    return list(_iter_admin_grouping(group))
 
 
 # 更新casbin admin资源角色关系
@@ -102,10 +143,13 @@ async def update_casbin_site_grouping(enforcer: AsyncEnforcer, site: BaseAdminSi
     """更新casbin admin资源角色关系"""
     roles = enforcer.get_filtered_named_grouping_policy("g2", 0)
     old_roles = {tuple(role) for role in roles}
-    new_roles = set(get_admin_grouping(site))
+    new_roles = set(_iter_admin_grouping(site))
+    if old_roles == new_roles:  # 资源角色没有变化
+        return
     remove_roles = old_roles - new_roles
     add_roles = new_roles - old_roles
     if remove_roles:  # 删除旧的资源角色
-        await enforcer.remove_named_grouping_policies("g2", [list(role) for role in remove_roles])
+        await enforcer.remove_named_grouping_policies("g2", list(map(list, remove_roles)))
     if add_roles:  # 添加新的资源角色
-        await enforcer.add_named_grouping_policies("g2", add_roles)
+        await enforcer.add_named_grouping_policies("g2", list(map(list, add_roles)))
+    clear_subject_options_cache()
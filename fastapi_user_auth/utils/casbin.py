@@ -1,4 +1,6 @@
-from typing import Any, Dict, List
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Dict, FrozenSet, List, Tuple
 
 from casbin import AsyncEnforcer
 from fastapi_amis_admin.utils.translation import i18n as _
@@ -8,6 +10,17 @@ from sqlalchemy.orm import Session
 from fastapi_user_auth.auth.models import CasbinRule
 from fastapi_user_auth.auth.schemas import SystemUserEnum
 
+# 主体页面权限选项缓存, key: (id(enforcer), id(group), subject), value: (全部页面权限, 过滤后的页面权限)
+subject_options_cache: "OrderedDict[Tuple[int, int, str], Tuple[list, list]]" = OrderedDict()
+SUBJECT_OPTIONS_CACHE_SIZE = 1024
+
+
+def clear_subject_options_cache():
+    """清除主体页面权限选项缓存.
+    本模块的权限更新函数会自动调用.直接通过enforcer修改策略,或者通过watcher重新加载策略后,需要手动调用.
+    角色权限变更会影响所有继承该角色的主体,所以清除全部缓存"""
+    subject_options_cache.clear()
+
 
 # 执行casbin字符串规则
 def permission_enforce(enforcer: AsyncEnforcer, subject: str, permission: str) -> bool:
@@ -18,13 +31,18 @@ def permission_enforce(enforcer: AsyncEnforcer, subject: str, permission: str) -
 # 将casbin规则转化为字符串
 def permission_encode(*field_values: str) -> str:
     """将casbin规则转化为字符串,从v1开始"""
-    return "#".join(val for val in field_values if val is not None)
+    if None not in field_values:
+        return "#".join(field_values)
+    return "#".join([val for val in field_values if val is not None])
 
 
 # 将字符串转化为casbin规则
-def permission_decode(permission: str) -> List[str]:
-    """将字符串转化为casbin规则"""
-    return permission.strip("#").split("#")
+@lru_cache(maxsize=4096)
+def permission_decode(permission: str) -> Tuple[str, ...]:
+    """将字符串转化为casbin规则,结果会被缓存,所以返回不可变的tuple"""
+    if permission[:1] == "#" or permission[-1:] == "#":  # 大部分规则没有首尾的#,不需要strip
+        permission = permission.strip("#")
+    return tuple(permission.split("#"))
 
 
 async def get_subject_page_permissions(enforcer: AsyncEnforcer, *, subject: str, implicit: bool = False) -> List[str]:
@@ -40,10 +58,22 @@ async def get_subject_page_permissions(enforcer: AsyncEnforcer, *, subject: str,
 async def update_subject_roles(enforcer: AsyncEnforcer, *, subject: str, role_keys: List[str]):
     """更新casbin主体权限角色"""
     # todo 避免角色链循环
-    new_roles = {(subject, role) for role in role_keys if role and role != subject}
-    await enforcer.delete_roles_for_user(subject)
-    if new_roles:
-        await enforcer.add_grouping_policies(new_roles)
+    old_roles = set(await enforcer.get_roles_for_user(subject))
+    new_roles = {role for role in role_keys if role and role != subject}
+    if old_roles == new_roles:  # 角色没有变化
+        return
+    remove_roles = old_roles - new_roles
+    add_roles = new_roles - old_roles
+    if remove_roles:
+        # 注意casbin缓存的是list,不能是tuple,否则无法删除.
+        removed = await enforcer.remove_grouping_policies([[subject, role] for role in remove_roles])
+        if not removed:
+            # 批量删除时任意一条规则不匹配(例如存在重复的规则),则全部不会删除.逐个按条件删除
+            for role in remove_roles:
+                await enforcer.remove_filtered_grouping_policy(0, subject, role)
+    if add_roles:
+        await enforcer.add_grouping_policies([[subject, role] for role in add_roles])
+    clear_subject_options_cache()
 
 
 async def update_subject_page_permissions(
@@ -53,16 +83,17 @@ async def update_subject_page_permissions(
     permissions: List[str],
 ) -> List[str]:
     """根据指定subject主体更新casbin规则,会删除旧的规则,添加新的规则"""
-    # 获取主体的页面权限
-    old_rules = enforcer.get_filtered_policy(0, subject, "", "", "page")
-    old_rules = {tuple(i) for i in old_rules}
     # 添加新的权限
     new_rules = set()
     for permission in permissions:
         perm = permission_decode(permission)
         if len(perm) == 3:  # 默认为allow
-            perm.append("allow")
+            perm = (*perm, "allow")
         new_rules.add((subject, *perm))
+    # 获取主体的页面权限,从enforcer内存中的策略读取,不会查询数据库
+    old_rules = {tuple(i) for i in enforcer.get_filtered_policy(0, subject, "", "", "page")}
+    if old_rules == new_rules:  # 权限没有变化
+        return permissions
     remove_rules = old_rules - new_rules
     add_rules = new_rules - old_rules
     if remove_rules:
@@ -71,12 +102,39 @@ async def update_subject_page_permissions(
         # 可能存在不存在的rule,导致批量删除失败. 例如站点页面
         # 如果存在重复的rule,则会导致批量删除失败.
         # todo 这个api有bug, 更换其他api
-        await enforcer.remove_policies([list(rule) for rule in remove_rules])
+        await enforcer.remove_policies(list(map(list, remove_rules)))
     if add_rules:
-        await enforcer.add_policies(add_rules)
+        await enforcer.add_policies(list(map(list, add_rules)))
+    clear_subject_options_cache()
     return permissions
 
 
+def _classify_rows(
+    rows: List[Dict[str, Any]],
+    allow_rule: FrozenSet[Tuple[str, ...]],
+    deny_rule: FrozenSet[Tuple[str, ...]],
+) -> List[List[Dict[str, Any]]]:
+    """按照allow,deny规则将字段行分为default,allow,deny三列"""
+    default_, allow_, deny_ = [], [], []
+    # 热点循环,提前绑定局部变量
+    default_append, allow_append, deny_append = default_.append, allow_.append, deny_.append
+    for row in rows:
+        perm = permission_decode(row["rol"])
+        reverse = row.get("reverse", False)
+        unchecked_item, checked_item = {"checked": False, **row}, {"checked": True, **row}
+        allow_item = deny_item = default_item = unchecked_item
+        if reverse ^ (perm in allow_rule):
+            allow_item = checked_item
+        elif reverse ^ (perm in deny_rule):
+            deny_item = checked_item
+        else:
+            default_item = checked_item
+        default_append(default_item)
+        allow_append(allow_item)
+        deny_append(deny_item)
+    return [default_, allow_, deny_]
+
+
 def get_subject_policy_matrix(
     enforcer: AsyncEnforcer,
     *,
@@ -84,8 +142,8 @@ def get_subject_policy_matrix(
     permission: str,
     rows: List[Dict[str, Any]],
 ):
-    """主体字段权限配置,存在allow,deny,default(未设置)"""
-    default_, allow_, deny_ = [], [], []
+    """主体字段权限配置,存在allow,deny,default(未设置).
+    只读取enforcer内存中的策略,不访问数据库,调用方无需与其他协程并发执行"""
     # bfc1eec773c2b331#page:list#page
     v1, v2, v3 = permission_decode(permission)
     v2 = "page:select" if v2 == "page" else v2
@@ -94,25 +152,12 @@ def get_subject_policy_matrix(
     deny_rule = set()
     for rule in rules:
         effect = rule[-1]
-        perm = permission_encode(*rule[1:-1])
+        perm = tuple(rule[1:-1])
         if effect == "allow":
             allow_rule.add(perm)
         else:
             deny_rule.add(perm)
-    for row in rows:
-        perm = row["rol"]
-        reverse = row.get("reverse", False)
-        allow_item = deny_item = default_item = {"checked": False, **row}
-        if reverse ^ (perm in allow_rule):
-            allow_item = {"checked": True, **row}
-        elif reverse ^ (perm in deny_rule):
-            deny_item = {"checked": True, **row}
-        else:
-            default_item = {"checked": True, **row}
-        default_.append(default_item)
-        allow_.append(allow_item)
-        deny_.append(deny_item)
-    return [default_, allow_, deny_]
+    return _classify_rows(rows, frozenset(allow_rule), frozenset(deny_rule))
 
 
 def get_subject_effect_matrix(
@@ -121,17 +166,18 @@ def get_subject_effect_matrix(
     subject: str,
     rows: List[Dict[str, Any]],
 ):
-    """主体字段权限执行结果,只有allow和deny两种情况"""
+    """主体字段权限执行结果,只有allow和deny两种情况.只读取enforcer内存中的策略,不访问数据库"""
     allow_, deny_ = [], []
     for row in rows:
         v1, v2, v3 = permission_decode(row["rol"])
         eff = enforcer.enforce(subject, v1, v2, v3)
         reverse = row.get("reverse", False)
-        allow_item = deny_item = {"checked": False, **row}
+        unchecked_item, checked_item = {"checked": False, **row}, {"checked": True, **row}
+        allow_item = deny_item = unchecked_item
         if reverse ^ eff:
-            allow_item = {"checked": True, **row}
+            allow_item = checked_item
         else:
-            deny_item = {"checked": True, **row}
+            deny_item = checked_item
         allow_.append(allow_item)
         deny_.append(deny_item)
     return [allow_, deny_]
@@ -179,6 +225,7 @@ async def update_subject_data_permissions(
     await enforcer.remove_filtered_policy(0, subject, v1, "", v2, "")
     if add_rules:
         await enforcer.add_policies(add_rules)
+    clear_subject_options_cache()
     return "success"
 
 
@@ -204,16 +204,8 @@ class Adapter(AsyncAdapter, AsyncUpdateAdapter):
         await self.db.async_commit()
         return res > 0
 
-    async def update_policy(self, sec: str, ptype: str, old_rule: List[str], new_rule: List[str]) -> None:
-        """
-        Update the old_rule with the new_rule in the database (storage).
-        :param sec: section type
-        :param ptype: policy type
-        :param old_rule: the old rule that needs to be modified
-        :param new_rule: the new rule to replace the old rule
-        :return: None
-        """
-
+    async def _update_policy(self, ptype: str, old_rule: List[str], new_rule: List[str]) -> None:
+        """Overwrite the old_rule with the new_rule without committing."""
         query: Select = select(self._db_class)
         query = query.filter(self._db_class.ptype == ptype)
 
@@ -225,12 +217,25 @@ class Adapter(AsyncAdapter, AsyncUpdateAdapter):
         # need the length of the longest_rule to perform overwrite
         longest_rule = old_rule if len(old_rule) > len(new_rule) else new_rule
         old_rule_line = await self.db.async_scalar(query)
+        if old_rule_line is None:
+            raise AdapterException(f"Policy rule not found: {old_rule}")
         # overwrite the old rule with the new rule
         for index in range(len(longest_rule)):
             if index < len(new_rule):
                 setattr(old_rule_line, f"v{index}", new_rule[index])
             else:  # pragma: no cover
                 setattr(old_rule_line, f"v{index}", None)
+
+    async def update_policy(self, sec: str, ptype: str, old_rule: List[str], new_rule: List[str]) -> None:
+        """
+        Update the old_rule with the new_rule in the database (storage).
+        :param sec: section type
+        :param ptype: policy type
+        :param old_rule: the old rule that needs to be modified
+        :param new_rule: the new rule to replace the old rule
+        :return: None
+        """
+        await self._update_policy(ptype, old_rule, new_rule)
         await self.db.async_commit()
 
     async def update_policies(
@@ -242,6 +247,8 @@ class Adapter(AsyncAdapter, AsyncUpdateAdapter):
     ) -> None:
         """
         Update the old_rules with the new_rules in the database (storage).
+        All rules are updated in a single transaction: if any old rule is not found,
+        the transaction is rolled back and no rule is updated.
         :param sec: section type
         :param ptype: policy type
         :param old_rules: the old rules that need to be modified
@@ -250,8 +257,13 @@ class Adapter(AsyncAdapter, AsyncUpdateAdapter):
         """
         if len(old_rules) != len(new_rules):
             raise ValueError("Invalid request, old and new rules must be of the same length")
-        for i, rule in enumerate(old_rules):  # todo optimize
-            await self.update_policy(sec, ptype, rule, new_rules[i])
+        try:
+            for old_rule, new_rule in zip(old_rules, new_rules):
+                await self._update_policy(ptype, old_rule, new_rule)
+        except Exception:
+            await self.db.async_rollback()
+            raise
+        await self.db.async_commit()
 
     async def update_filtered_policies(
         self, sec: str, ptype: str, new_rules: Iterable[Tuple[str]], field_index: int, *field_values: Tuple[str]
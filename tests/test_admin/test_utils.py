@@ -4,12 +4,14 @@ from sqlalchemy import delete
 
 from fastapi_user_auth.admin import AuthAdminSite
 from fastapi_user_auth.admin.utils import (
+    clear_subject_options_cache,
     get_admin_action_options,
     get_admin_action_options_by_subject,
     get_admin_grouping,
     update_casbin_site_grouping,
 )
 from fastapi_user_auth.auth.models import CasbinRule
+from fastapi_user_auth.utils.casbin import update_subject_page_permissions, update_subject_roles
 
 
 @pytest.fixture
@@ -100,6 +102,59 @@ def test_get_admin_action_options_by_subject(site: AuthAdminSite, admin_instance
     assert user_admin_unique_id + "#page:bulk_delete#page" not in user_admin_options
     assert user_admin_unique_id + "#page:update_subject_page_permissions#page" in user_admin_options
     assert user_admin_unique_id + "#page:update_subject_roles#page" not in user_admin_options
+    options2 = get_admin_action_options_by_subject(site.auth.enforcer, "u:admin", site)
+    assert options is options2  # test cache
+
+
+async def test_get_admin_action_options_by_subject_invalidation(site: AuthAdminSite, admin_instances: dict, fake_data):
+    enforcer = site.auth.enforcer
+    user_auth_app_value = admin_instances["user_auth_app"].unique_id + "#page#page"
+    home_admin_value = admin_instances["home_admin"].unique_id + "#page#page"
+
+    def get_values(subject: str) -> set:
+        return {item["value"] for item in get_admin_action_options_by_subject(enforcer, subject, site)}
+
+    assert get_values("u:test") == {home_admin_value}
+    # 通过update_subject_page_permissions授权
+    await update_subject_page_permissions(enforcer, subject="r:test", permissions=[home_admin_value, user_auth_app_value])
+    assert get_values("u:test") == {home_admin_value, user_auth_app_value}
+    # 通过update_subject_page_permissions撤销权限
+    await update_subject_page_permissions(enforcer, subject="r:test", permissions=[home_admin_value])
+    assert get_values("u:test") == {home_admin_value}
+    # 通过update_subject_roles授权和撤销
+    await update_subject_roles(enforcer, subject="u:test", role_keys=["r:test", "r:admin"])
+    assert user_auth_app_value in get_values("u:test")
+    await update_subject_roles(enforcer, subject="u:test", role_keys=[])
+    assert get_values("u:test") == set()
+    # 直接通过enforcer授权和撤销,需要手动清除缓存
+    await enforcer.add_policy("u:test", admin_instances["home_admin"].unique_id, "page", "page", "allow")
+    clear_subject_options_cache()
+    assert get_values("u:test") == {home_admin_value}
+    await enforcer.remove_policy("u:test", admin_instances["home_admin"].unique_id, "page", "page", "allow")
+    clear_subject_options_cache()
+    assert get_values("u:test") == set()
+
+
+async def test_get_admin_action_options_by_subject_watcher_reload(site: AuthAdminSite, admin_instances: dict, fake_data):
+    enforcer = site.auth.enforcer
+    home_admin_value = admin_instances["home_admin"].unique_id + "#page#page"
+    user_auth_app_value = admin_instances["user_auth_app"].unique_id + "#page#page"
+
+    # watcher回调在第一次查询之前注册
+    async def update_callback():
+        await enforcer.load_policy()
+        clear_subject_options_cache()
+
+    def get_values(subject: str) -> set:
+        return {item["value"] for item in get_admin_action_options_by_subject(enforcer, subject, site)}
+
+    assert get_values("u:test") == {home_admin_value}
+    # 其他进程修改数据库后,watcher触发重新加载策略
+    site.db.add(CasbinRule(ptype="g", v0="u:test", v1="r:admin"))
+    await site.db.async_commit()
+    await update_callback()
+    assert await enforcer.has_role_for_user("u:test", "r:admin")
+    assert get_values("u:test") == {home_admin_value, user_auth_app_value}
 
 
 def test_get_admin_grouping(site: AuthAdminSite, admin_instances: dict):
@@ -111,7 +166,7 @@ def test_get_admin_grouping(site: AuthAdminSite, admin_instances: dict):
 
 async def test_casbin_update_site_grouping(site: AuthAdminSite, admin_instances: dict):
     await update_casbin_site_grouping(site.auth.enforcer, site)
-    grouping = site.auth.enforcer.get_named_grouping_policy("g2")
+    grouping = {tuple(role) for role in site.auth.enforcer.get_named_grouping_policy("g2")}
     assert (site.unique_id, admin_instances["home_admin"].unique_id) in grouping
     assert (site.unique_id, admin_instances["user_auth_app"].unique_id) in grouping
     assert (admin_instances["user_auth_app"].unique_id, admin_instances["user_admin"].unique_id) in grouping
@@ -1,6 +1,6 @@
 import pytest
 from casbin import AsyncEnforcer
-from sqlalchemy import delete
+from sqlalchemy import delete, select
 
 from fastapi_user_auth.admin import AuthAdminSite
 from fastapi_user_auth.admin.utils import update_casbin_site_grouping
@@ -10,6 +10,7 @@ from fastapi_user_auth.utils.casbin import (
     update_subject_page_permissions,
     update_subject_roles,
 )
+from fastapi_user_auth.utils.sqlachemy_adapter import AdapterException
 
 
 @pytest.fixture
@@ -67,13 +68,30 @@ async def test_casbin_get_subject_page_permissions(enforcer: AsyncEnforcer, admi
     assert permissions2 == permissions
 
 
-async def test_casbin_update_subject_roles(enforcer: AsyncEnforcer, admin_instances: dict, fake_data):
+async def test_casbin_update_subject_roles(db, enforcer: AsyncEnforcer, admin_instances: dict, fake_data):
     admin_roles = await enforcer.get_implicit_roles_for_user("u:admin")
     assert "r:admin" in admin_roles
     await update_subject_roles(enforcer, subject="u:admin", role_keys=["r:test"])
     admin_roles = await enforcer.get_implicit_roles_for_user("u:admin")
     assert "r:admin" not in admin_roles
     assert "r:test" in admin_roles
+    await update_subject_roles(enforcer, subject="u:admin", role_keys=["r:test", "r:vip"])
+    await update_subject_roles(enforcer, subject="u:admin", role_keys=["r:vip", "r:test"])  # 角色没有变化
+    assert set(await enforcer.get_roles_for_user("u:admin")) == {"r:test", "r:vip"}
+    await update_subject_roles(enforcer, subject="u:admin", role_keys=[])  # 删除未重新加载的新增角色
+    assert await enforcer.get_roles_for_user("u:admin") == []
+    await enforcer.load_policy()
+    assert await enforcer.get_roles_for_user("u:admin") == []
+    # 存在重复的角色规则
+    await db.async_execute(delete(CasbinRule).where(CasbinRule.ptype == "g"))
+    db.add_all([CasbinRule(ptype="g", v0="u:admin", v1="r:admin"), CasbinRule(ptype="g", v0="u:admin", v1="r:admin")])
+    await db.async_commit()
+    await enforcer.load_policy()
+    assert await enforcer.get_roles_for_user("u:admin") == ["r:admin"]
+    await update_subject_roles(enforcer, subject="u:admin", role_keys=["r:test"])
+    assert await enforcer.get_roles_for_user("u:admin") == ["r:test"]
+    await enforcer.load_policy()
+    assert await enforcer.get_roles_for_user("u:admin") == ["r:test"]
 
 
 async def test_casbin_update_subject_page_permissions(enforcer: AsyncEnforcer, admin_instances: dict, fake_data):
@@ -99,3 +117,41 @@ async def test_casbin_update_subject_page_permissions(enforcer: AsyncEnforcer, a
     # 非page权限应该保留
     assert enforcer.has_policy("r:admin", user_admin_unique_id, "page:list:email", "page:list", "allow")
     assert enforcer.has_policy("r:admin", user_admin_unique_id, "page:filter:email", "page:filter", "allow")
+    # 删除未重新加载的新增权限
+    await update_subject_page_permissions(enforcer, subject="r:admin", permissions=[])
+    permissions = await get_subject_page_permissions(enforcer, subject="r:admin")
+    assert permissions == []
+
+
+async def test_adapter_update_policies(db, enforcer: AsyncEnforcer, fake_data):
+    old_rules = [
+        ["r:test", "page_1", "page", "page", "allow"],
+        ["r:test", "page_2", "page", "page", "allow"],
+        ["r:test", "page_3", "page", "page", "allow"],
+    ]
+    new_rules = [
+        ["r:test", "page_1", "page", "page", "deny"],
+        ["r:test", "page_4", "page", "page", "allow"],
+        ["r:test", "page_3", "page:list", "page", "allow"],
+    ]
+    await enforcer.add_policies(old_rules)
+    assert await enforcer.update_policies(old_rules, new_rules)
+    rows = await db.async_scalars(select(CasbinRule).where(CasbinRule.v0 == "r:test", CasbinRule.v1.like("page_%")))
+    assert sorted([row.v0, row.v1, row.v2, row.v3, row.v4] for row in rows) == sorted(new_rules)
+    await enforcer.load_policy()
+    for rule in new_rules:
+        assert enforcer.has_policy(*rule)
+    for rule in old_rules:
+        assert not enforcer.has_policy(*rule)
+    # 任意一条规则不存在时,全部规则都不更新
+    with pytest.raises(AdapterException):
+        await enforcer.adapter.update_policies(
+            "p",
+            "p",
+            [new_rules[0], ["r:test", "page_5", "page", "page", "allow"]],
+            [old_rules[0], ["r:test", "page_6", "page", "page", "allow"]],
+        )
+    await enforcer.load_policy()
+    for rule in new_rules:
+        assert enforcer.has_policy(*rule)
+    assert not enforcer.has_policy(*old_rules[0])